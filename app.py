@@ -51,6 +51,13 @@ class MultiNotifications(Application):
         self._service.stop()
         self._service = None
 
+    def task_view(self):
+        """
+        Return the local view of the current task state, kept up to date by the
+        notifications service. Reading it does not query Shotgun
+        """
+        return self._service.task_view()
+
     def service_running(self):
         return self._service.is_running()
 
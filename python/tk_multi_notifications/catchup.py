@@ -0,0 +1,104 @@
+"""
+This module contains the catch-up of the events filters when they
+are far behind the newest event: the gap is split in event id ranges
+fetched concurrently and merged back in id order
+"""
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+def log(msg):
+    print time.strftime("%Y/%m/%d %H:%M:%S", time.localtime()) +": "+msg
+
+
+def shard_ranges(first_id, last_id, shard_size):
+    """ Split the first_id to last_id range, both included, in ranges of shard_size ids """
+    return [(start, min(start + shard_size - 1, last_id)) for start in range(first_id, last_id + 1, shard_size)]
+
+
+class CatchUp(object):
+    """
+    Fetch the events of an id range with a bounded pool of workers, one
+    shard of shard_size ids per query. Shotgun connections cannot be shared
+    between threads, every worker gets its own from connection_factory.
+    The pool and its connections are kept until close is called, the next
+    catch-up then creates them again
+    """
+    def __init__(self, connection_factory, workers=4, shard_size=100):
+        super(CatchUp, self).__init__()
+        self.connection_factory = connection_factory
+        self.workers = workers
+        self.shard_size = shard_size
+        self._local = threading.local()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # Connections of the workers, closed along with the pool
+        self._connections = []
+
+    def _get_pool(self):
+        """ Return the workers pool, created on the first catch-up """
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            return self._pool
+
+    def _connection(self):
+        """ Return the Shotgun connection of the current worker """
+        if getattr(self._local, 'sg', None) is None:
+            self._local.sg = self.connection_factory()
+            with self._pool_lock:
+                self._connections.append(self._local.sg)
+        return self._local.sg
+
+    def close(self):
+        """
+        Stop the workers and close their connections. A catch-up running at the
+        same time finishes its queued shards, the workers exit after them
+        """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        if pool is not None:
+            pool.close()
+        for sg in connections:
+            sg.close()
+
+    def fetch(self, entity_type, filters, fields, first_id, last_id):
+        """
+        Return the entities matching the filters with an id from first_id to last_id,
+        in id order, and the id up to which they were all fetched. If a shard fails,
+        only the entities of the shards before it are returned
+        """
+        shards = shard_ranges(first_id, last_id, self.shard_size)
+
+        def fetch_shard(shard):
+            sg = self._connection()
+            try:
+                return sg.find(entity_type,
+                               filters=filters + [['id', 'between', list(shard)]],
+                               fields=fields,
+                               order=[{'column': 'id', 'direction': 'asc'}],
+                               filter_operator='all')
+            except Exception:
+                # Do not reuse a connection that may be broken
+                with self._pool_lock:
+                    if sg in self._connections:
+                        self._connections.remove(sg)
+                self._local.sg = None
+                sg.close()
+                raise
+
+        entities = []
+        fetched_id = first_id - 1
+        # imap yields the shards results in order, whatever order they complete in
+        results = self._get_pool().imap(fetch_shard, shards)
+        for shard in shards:
+            try:
+                entities.extend(next(results))
+            except Exception as error:
+                log('Catch-up of events #%d to #%d failed: %s' % (shard[0], shard[1], error))
+                break
+            fetched_id = shard[1]
+        return entities, fetched_id
@@ -65,6 +65,7 @@ class AppDialog(QtGui.QWidget):
         self.create_layout()
         self.create_connections()
         self.update_status(self._app.service_running())
+        self.update_task_status()
 
     def create_layout(self):
         # Create a main layout
@@ -74,9 +75,13 @@ class AppDialog(QtGui.QWidget):
         self.start_button = QtGui.QPushButton(self.START_TEXT)
         self.status_label = QtGui.QLabel('Status')
         self.status = QtGui.QLabel(self.STATUS_STOPPED)
+        self.task_status_label = QtGui.QLabel('Task Status')
+        self.task_status = QtGui.QLabel('')
         self.close_button = QtGui.QPushButton('Close')
         # Layout the status label and text
         self.status_layout = QtGui.QHBoxLayout()
+        self.status_layout.addWidget(self.task_status_label, 0)
+        self.status_layout.addWidget(self.task_status, 0)
         self.status_layout.addStretch(1)
         self.status_layout.addWidget(self.status_label, 0)
         self.status_layout.addWidget(self.status, 0)
@@ -116,3 +121,9 @@ class AppDialog(QtGui.QWidget):
             status_text = self.STATUS_STARTED
         self.start_button.setText(button_text)
         self.status.setText(status_text)
+
+    def update_task_status(self):
+        """ Show the task status from the local task view, without querying Shotgun """
+        view = self._app.task_view()
+        if view is not None:
+            self.task_status.setText(view.status_name())
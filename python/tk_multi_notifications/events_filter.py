@@ -4,6 +4,16 @@ the shotgun event database and return an object
 that will display a notification
 """
 import time
+import threading
+
+from task_view import TaskView
+
+# Priority lanes a filter can belong to. Urgent filters are polled often with
+# a narrow query and shown right away, bulk filters are polled less often and
+# their notifications are delivered as a digest.
+PRIORITY_URGENT = 'urgent'
+PRIORITY_BULK = 'bulk'
+PRIORITIES = (PRIORITY_URGENT, PRIORITY_BULK)
 
 def log(msg):
     print time.strftime("%Y/%m/%d %H:%M:%S", time.localtime()) +": "+msg
@@ -38,13 +48,37 @@ class Notification(object):
 
 class EventsFilter(object):
     """ Class used to """
-    def __init__(self, shotgun_api, task=None, filter_classes=[]):
+    def __init__(self, shotgun_api, task=None, filter_classes=[], cache=None, catchup=None, connection_factory=None):
         super(EventsFilter, self).__init__()
         self.sg = shotgun_api
         self.task = task
+        # Shotgun connections cannot be shared between threads. With a connection
+        # factory every priority lane gets its own connection and lock, so an urgent
+        # run never waits for a bulk one. Otherwise the lanes share self.sg and a lock
+        self.connection_factory = connection_factory
+        self._connections = {}
+        self._lane_locks = {}
+        self._shared_lock = threading.Lock()
+        # Optional HydrationCache and CatchUp shared by the filters
+        self.cache = cache
+        self.catchup = catchup
         self.last_event_id = 0
         self._filters = []
+        # Protect the bookkeeping shared by the lanes
+        self._lock = threading.Lock()
+        # Events pushed by a webhook receiver, by event type. In push mode the
+        # filters only poll Shotgun every reconcile_interval seconds to fill gaps
+        self.push_mode = False
+        self.reconcile_interval = 300
+        self._pushed_events = {}
+        self._push_lock = threading.Lock()
+        self._polled_at = {}
         self.get_last_event_id()
+        # Local view of the task state, kept up to date from the events found
+        self.view = None
+        if self.task is not None:
+            self.view = TaskView(self.sg, self.task)
+            self.view.seed()
         # init the class with the data we got in the arguments
         self.set_filters(filter_classes)
 
@@ -55,31 +89,170 @@ class EventsFilter(object):
 
     def add_filter(self, filter_class):
         """ Instatiate the provide filter_class and store it in the filters list """
-        self._filters.append(filter_class(self.sg, self.task, self.last_event_id))
-
-    def filters(self):
-        """ Return all the filters instances """
-        return self._filters
+        _filter = filter_class(self._connection(filter_class.priority), self.task, self.last_event_id)
+        _filter.cache = self.cache
+        _filter.catchup = self.catchup
+        # Share the status map the view already fetched
+        if isinstance(_filter, TaskStatusChangedFilter) and self.view is not None:
+            _filter.statuses = self.view.statuses
+        self._filters.append(_filter)
+
+    def _connection(self, priority):
+        """ Return the Shotgun connection used by the provided priority lane """
+        if self.connection_factory is None:
+            return self.sg
+        if priority not in self._connections:
+            self._connections[priority] = self.connection_factory()
+        return self._connections[priority]
+
+    def _lane_lock(self, priority):
+        """ Return the lock making sure a lane connection is only used by one run at a time """
+        if self.connection_factory is None:
+            return self._shared_lock
+        with self._lock:
+            return self._lane_locks.setdefault(priority, threading.Lock())
+
+    def filters(self, priority=None):
+        """ Return all the filters instances, or only the ones of the provided priority """
+        if priority is None:
+            return self._filters
+        return [_filter for _filter in self._filters if _filter.priority == priority]
+
+    def event_types(self):
+        """ Return the event types watched by the filters """
+        return set(_filter.event_type for _filter in self._filters)
+
+    def enable_push(self, reconcile_interval=None):
+        """ Switch to push mode, the pushed events are processed and Shotgun is only polled to reconcile """
+        self.push_mode = True
+        if reconcile_interval is not None:
+            self.reconcile_interval = reconcile_interval
+
+    def disable_push(self):
+        """ Switch back to polling every run """
+        self.push_mode = False
+
+    def reconcile(self):
+        """ Make every filter poll Shotgun on its next run """
+        with self._lock:
+            self._polled_at = {}
+
+    def push(self, events):
+        """
+        Store events received from outside, a webhook for example, until the
+        next run. Return the priorities of the filters watching them
+        """
+        priorities = set()
+        with self._push_lock:
+            for event in events:
+                for _filter in self._filters:
+                    if _filter.event_type == event['event_type']:
+                        priorities.add(_filter.priority)
+                        self._pushed_events.setdefault(event['event_type'], []).append(event)
+                        break
+        return priorities
+
+    def _take_pushed_events(self, filters):
+        """ Remove and return the pushed events of the provided filters by event type """
+        with self._push_lock:
+            return dict((_filter.event_type, self._pushed_events.pop(_filter.event_type, [])) for _filter in filters)
+
+    def _needs_poll(self, _filter):
+        """ Return True if the filter has to query Shotgun on this run """
+        if not self.push_mode:
+            return True
+        with self._lock:
+            polled_at = self._polled_at.get(_filter, 0)
+        return time.time() - polled_at >= self.reconcile_interval
+
+    def stats(self):
+        """ Return the statistics of the events filter """
+        stats = {'last_event_id': self.last_event_id}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+    def get_head_event_id(self, sg=None):
+        """ Return the id of the newest event in the event table """
+        result = (sg or self.sg).find_one('EventLogEntry', filters=[], fields=['id'], order=[{'column':'id', 'direction':'desc'}])
+        return result['id']
 
     def get_last_event_id(self):
         """ Get the last event id from the event table """
-        result = self.sg.find_one('EventLogEntry', filters=[], fields=['id'], order=[{'column':'id', 'direction':'desc'}])
-        self.last_event_id = result['id']
-
-    def run(self):
-        """ Run all the filters query and return all the filters containing valid events """
-        log('Beginning processing starting at event #%d' % self.last_event_id)
-        for _filter in self._filters:
-            _filter.find()
-        # Get the last event id and push it to the filter instances
-        self.get_last_event_id()
-        for _filter in self._filters:
-            _filter.last_event_id = self.last_event_id
+        self.last_event_id = self.get_head_event_id()
+
+    def run(self, priority=None):
+        """
+        Run the filters query of the provided priority (all of them if None)
+        and return the filters containing valid events
+        """
+        if priority is None:
+            found = []
+            for lane in PRIORITIES:
+                found.extend(self.run(lane))
+            return found
+        with self._lane_lock(priority):
+            log('Beginning %s processing starting at event #%d' % (priority, self.last_event_id))
+            sg = self._connection(priority)
+            filters = self.filters(priority)
+            pushed_events = self._take_pushed_events(filters)
+            head_event_id = None
+            found = []
+            for _filter in filters:
+                events = pushed_events[_filter.event_type]
+                if self._needs_poll(_filter):
+                    # The newest event id lets the filters detect they are far behind
+                    # and switch to the backlog mode
+                    if head_event_id is None:
+                        head_event_id = self.get_head_event_id(sg)
+                    has_events = _filter.find(head_event_id, events)
+                    with self._lock:
+                        self._polled_at[_filter] = time.time()
+                else:
+                    has_events = _filter.receive(events)
+                if has_events:
+                    found.append(_filter)
+            # A filter in backlog mode may have found nothing on the task in the events
+            # it hydrated, the view still has to be seeded again for the older ones
+            self.update_view(filters, sg)
+            # Every filter moves its own cursor over the events it fetched, keep
+            # track of the newest one so filters added later start from there
+            with self._lock:
+                for _filter in filters:
+                    self.last_event_id = max(self.last_event_id, _filter.last_event_id)
+        return found
+
+    def update_view(self, filters, sg=None):
+        """ Apply the events found by the provided filters to the task view """
+        if self.view is None:
+            return
+        # Filters in backlog mode only hydrated their most recent events,
+        # the view cannot be patched and is seeded again instead
+        if any(_filter.backlog is not None for _filter in filters):
+            self.view.seed(sg=sg)
+            return
+        for _filter in filters:
+            _filter.update_view(self.view)
 
 
 class EventFilterBase(object):
     """ Base class for filtering a shotgun event """
     event_type = ''
+    priority = PRIORITY_BULK
+    # Name used for this filter's notifications in a digest message
+    digest_name = 'activity'
+    # HydrationCache consulted before fetching entities from Shotgun, set by the events filter
+    cache = None
+    # CatchUp fetching the events in parallel when the filter is more than
+    # one shard behind, but not enough for the backlog mode. Set by the events filter
+    catchup = None
+    # When the filter is more than backlog_threshold events behind the newest
+    # event, only count the events on the server and hydrate the most recent ones
+    backlog_threshold = 500
+    backlog_hydrate_count = 10
+    # True if the events query only matches valid events, the backlog summary
+    # count can then be shown as is. Otherwise only the hydrated matches are counted
+    backlog_exact = False
 
     def __init__(self, shotgun_api, task, last_event_id):
         super(EventFilterBase, self).__init__()
@@ -87,28 +260,208 @@ class EventFilterBase(object):
         self.task = task
         self.last_event_id = last_event_id
         self.events = []
+        # Summary of the events found in backlog mode, None otherwise
+        self.backlog = None
+        # Ids of the pushed events newer than the cursor that were already processed
+        self._delivered_ids = set()
 
     def valid_events(self):
         return self._valid_events
 
-    def _find(self):
+    def _find(self, events):
+        """ Return the data of the provided events that are valid for this filter """
         raise NotImplementedError()
 
-    def _find_events(self):
-        """ Find all event of the type stored in the class """
+    def _event_filters(self):
+        """
+        Return extra filters narrowing the EventLogEntry query of this filter.
+        Urgent filters should keep their query as narrow as possible since they are
+        polled often
+        """
+        return []
+
+    def _find_events(self, head_event_id=None):
+        """
+        Find all event of the type stored in the class. head_event_id is the newest
+        event id read before the query, the cursor moves up to it even if none of the
+        events before it are of this type, so the site traffic does not look like a backlog
+        """
         events = self.sg.find('EventLogEntry',
                                 filters=[
                                     ['event_type', 'is', self.event_type],
                                     ['id', 'greater_than', self.last_event_id],
-                                ],
+                                ] + self._event_filters(),
                                 fields=['id', 'event_type', 'attribute_name', 'meta', 'entity'],
                                 order=[{'column':'created_at', 'direction':'asc'}],
                                 filter_operator='all')
+        # Move the cursor over everything we fetched, even the events dropped
+        # by the filter, so they are never fetched again
+        for event in events:
+            self.last_event_id = max(self.last_event_id, event['id'])
+        if head_event_id is not None:
+            self.last_event_id = max(self.last_event_id, head_event_id)
         return events
 
-    def find(self):
-        self.events = self._find()
-        return True if self.events else False
+    def _find_backlog_events(self, head_event_id):
+        """
+        Count the events up to head_event_id on the server and only return the
+        most recent ones. The count is a raw event count, the events dropped by
+        _find are not known without hydrating them
+        """
+        filters = [
+            ['event_type', 'is', self.event_type],
+            ['id', 'between', [self.last_event_id + 1, head_event_id]],
+        ] + self._event_filters()
+        summary = self.sg.summarize('EventLogEntry',
+                                    filters=filters,
+                                    summary_fields=[{'field': 'id', 'type': 'count'}],
+                                    filter_operator='all')
+        self.backlog = {
+            'count': summary['summaries']['id'],
+            'fetched': 0,
+        }
+        events = self.sg.find('EventLogEntry',
+                                filters=filters,
+                                fields=['id', 'event_type', 'attribute_name', 'meta', 'entity'],
+                                order=[{'column':'id', 'direction':'desc'}],
+                                filter_operator='all',
+                                limit=self.backlog_hydrate_count)
+        events.reverse()
+        self.last_event_id = head_event_id
+        return events
+
+    def _catch_up_events(self, head_event_id):
+        """
+        Fetch the events up to head_event_id in id range shards. The cursor only
+        moves over the shards fetched, a failed shard is fetched again on the next run
+        """
+        events, fetched_id = self.catchup.fetch('EventLogEntry',
+                                                [['event_type', 'is', self.event_type]] + self._event_filters(),
+                                                ['id', 'event_type', 'attribute_name', 'meta', 'entity'],
+                                                self.last_event_id + 1,
+                                                head_event_id)
+        self.last_event_id = max(self.last_event_id, fetched_id)
+        return events
+
+    def _matches_query(self, event):
+        """
+        Return True if the event is one the events query of this filter would return.
+        Only the 'is' operator of the _event_filters is supported
+        """
+        if event['event_type'] != self.event_type:
+            return False
+        for field, operator, value in self._event_filters():
+            if operator != 'is':
+                raise NotImplementedError('Unsupported operator %s' % operator)
+            event_value = event.get(field)
+            if isinstance(value, dict):
+                if not event_value or (event_value['type'], event_value['id']) != (value['type'], value['id']):
+                    return False
+            elif event_value != value:
+                return False
+        return True
+
+    def _new_events(self, events):
+        """
+        Return the pushed events not processed yet. The ones the events query would
+        return are remembered as processed, so the next poll does not process them again
+        """
+        new_events = []
+        for event in events:
+            if event['event_type'] != self.event_type:
+                continue
+            if event['id'] <= self.last_event_id or event['id'] in self._delivered_ids:
+                continue
+            if self._matches_query(event):
+                self._delivered_ids.add(event['id'])
+            new_events.append(event)
+        return new_events
+
+    def find(self, head_event_id=None, pushed_events=()):
+        """
+        Find the valid events since the last event id, along with the pushed ones.
+        If the filter is too far behind head_event_id, the events are summarized
+        instead of being all fetched, or fetched in parallel shards if it is only
+        a few shards behind
+        """
+        self.backlog = None
+        first_event_id = self.last_event_id + 1
+        delivered_ids = set(self._delivered_ids)
+        pushed_events = self._new_events(pushed_events)
+        if head_event_id is not None and head_event_id - self.last_event_id > self.backlog_threshold:
+            log('%s is %d events behind, summarizing the backlog' % (type(self).__name__, head_event_id - self.last_event_id))
+            events = self._find_backlog_events(head_event_id)
+        elif head_event_id is not None and self.catchup is not None and head_event_id - self.last_event_id > self.catchup.shard_size:
+            log('%s is %d events behind, catching up' % (type(self).__name__, head_event_id - self.last_event_id))
+            events = self._catch_up_events(head_event_id)
+        else:
+            events = self._find_events(head_event_id)
+        # Skip the events already pushed, the cursor now covers them
+        events = [event for event in events if event['id'] not in self._delivered_ids]
+        if self.backlog is not None:
+            # The events pushed by earlier runs were already reported, do not count them again.
+            # Only the ones matching the events query were remembered, they are in the summary
+            reported = len([_id for _id in delivered_ids if first_event_id <= _id <= head_event_id])
+            self.backlog['count'] = max(0, self.backlog['count'] - reported)
+            self.backlog['fetched'] = len(set(event['id'] for event in events + pushed_events
+                                              if event['id'] <= head_event_id))
+        events = sorted(pushed_events + events, key=lambda event: event['id'])
+        self._delivered_ids = set(_id for _id in self._delivered_ids if _id > self.last_event_id)
+        self.events = self._find(events)
+        return self.count() > 0
+
+    def receive(self, pushed_events):
+        """ Find the valid events among the pushed ones, without querying the events table """
+        self.backlog = None
+        self.events = self._find(self._new_events(pushed_events))
+        return self.count() > 0
+
+    def count(self):
+        """
+        Return the number of valid events found, including the ones only
+        summarized if the summary only counts valid events
+        """
+        if self.backlog is not None and self.backlog_exact:
+            return self.backlog['count']
+        return len(self.events)
+
+    def more(self):
+        """ Return True if older events were only summarized and some of them may be valid too """
+        if self.backlog is None or self.backlog_exact:
+            return False
+        return self.backlog['count'] > self.backlog['fetched']
+
+    def _find_entity(self, entity_type, entity_id, fields):
+        """ Return the entity from the hydration cache, or from Shotgun if it is not cached """
+        if self.cache is not None:
+            entity = self.cache.get(entity_type, entity_id, fields)
+            if entity is not None:
+                return entity
+        entity = self.sg.find_one(entity_type, filters=[['id', 'is', entity_id]], fields=fields)
+        if entity is not None and self.cache is not None:
+            self.cache.set(entity_type, entity_id, entity)
+        return entity
+
+    def _find_entities(self, entity_type, entity_ids, fields, filters=[]):
+        """
+        Return a dict of entity id to entity, from the hydration cache or from a single
+        Shotgun query for the ones not cached. The query can be narrowed with filters,
+        the entities it does not return are missing from the dict
+        """
+        entities = {}
+        missing_ids = []
+        for entity_id in set(entity_ids):
+            entity = self.cache.get(entity_type, entity_id, fields) if self.cache is not None else None
+            if entity is not None:
+                entities[entity_id] = entity
+            else:
+                missing_ids.append(entity_id)
+        if missing_ids:
+            for entity in self.sg.find(entity_type, filters=[['id', 'in', missing_ids]] + filters, fields=fields):
+                entities[entity['id']] = entity
+                if self.cache is not None:
+                    self.cache.set(entity_type, entity['id'], entity)
+        return entities
 
     def get_url(self, entity):
         url = ''
@@ -127,10 +480,23 @@ class EventFilterBase(object):
         """ build the message list for every event """
         raise NotImplementedError()
 
+    def update_view(self, view):
+        """ Apply every events found to the provided task view """
+        for event in self.events:
+            self._update_view(view, event)
+
+    def _update_view(self, view, event):
+        """ Apply the event to the task view, the default filter does not change the view """
+        pass
+
 
 class TaskStatusChangedFilter(EventFilterBase):
     """ Filter current task status changed """
     event_type = 'Shotgun_Task_Change'
+    priority = PRIORITY_URGENT
+    digest_name = 'status change'
+    # The events query is narrowed to the status changes of the task
+    backlog_exact = True
 
     def __init__(self, *args, **kwargs):
         super(TaskStatusChangedFilter, self).__init__(*args, **kwargs)
@@ -148,15 +514,25 @@ class TaskStatusChangedFilter(EventFilterBase):
         self.get_statuses()
         return self.statuses.get(code, '')
 
-    def _find(self):
+    def _event_filters(self):
+        """ Only query the status changes of the current task """
+        return [
+            ['entity', 'is', {'type': 'Task', 'id': self.task['id']}],
+            ['attribute_name', 'is', 'sg_status_list'],
+        ]
+
+    def _find(self, events):
         """ Find all the valid events """
         # Get all thes statuses
         self.get_statuses()
         # Store the event and the status
         events_data = []
-        for event in self._find_events():
+        for event in events:
             if event['attribute_name'] != 'sg_status_list':
                 continue
+            # Pushed events are not narrowed by the query, check they are about the task
+            if not event['entity'] or event['entity']['id'] != self.task['id']:
+                continue
             # Get the status
             status = self.get_status_from_code(event['meta']['new_value'])
             events_data.append((event, status))
@@ -166,30 +542,34 @@ class TaskStatusChangedFilter(EventFilterBase):
         """ build the message for the provided event """
         # extract the event and the status from the tuple
         event, status = event_data
-        message = 'Status of task %s %s changed to %s' % (self.task['entity']['name'], event['entity']['name'], status)
+        message = 'Status of task %s %s changed to %s' % (self.task['entity']['name'], event['entity'].get('name', ''), status)
         return Notification(message, self.get_url(self.task))
 
+    def _update_view(self, view, event_data):
+        """ Store the new status of the task """
+        event, status = event_data
+        view.set_status(event['meta']['new_value'], status)
+
 
 class NewPublishFilter(EventFilterBase):
     """ Filter new publishes linked to the current task """
     event_type = 'Shotgun_PublishedFile_New'
+    priority = PRIORITY_BULK
+    digest_name = 'publish'
 
     def __init__(self, *args, **kwargs):
         super(NewPublishFilter, self).__init__(*args, **kwargs)
         self.statuses = None
 
-    def _find(self):
+    def _find(self, events):
         """ Find all the valid events """
         events_data = []
-        for event in self._find_events():
+        for event in events:
             # Find the matching publish document
-            publish = self.sg.find_one("PublishedFile",
-                                    filters=[['id', 'is', event['entity']['id']]],
-                                    fields=['id','published_file_type', 'code', 'entity'],
-                                    filter_operator='all',
-                                 )
+            publish = self._find_entity('PublishedFile', event['entity']['id'],
+                                        ['id','published_file_type', 'code', 'entity'])
             # Only keep the publish if it is linked to the task or the task entity
-            if publish['entity'] and publish['entity']['id'] == self.task['entity']['id']:
+            if publish and publish['entity'] and publish['entity']['id'] == self.task['entity']['id']:
                 events_data.append((event, publish))
         return events_data
 
@@ -204,28 +584,37 @@ class NewPublishFilter(EventFilterBase):
             message = 'A new element "%s" was published for entity %s' % (publish['code'], entity_name)
         return Notification(message, self.get_url(publish))
 
+    def _update_view(self, view, event_data):
+        """ Store the new publish as the latest one of its type """
+        event, publish = event_data
+        view.add_publish(publish)
+
 
 class NewNoteFilter(EventFilterBase):
     """ Filter new notes events linked to the current task """
     event_type = 'Shotgun_Note_New'
+    priority = PRIORITY_URGENT
+    digest_name = 'note'
 
     def __init__(self, *args, **kwargs):
         super(NewNoteFilter, self).__init__(*args, **kwargs)
         self.statuses = None
 
-    def _find(self):
+    def _find(self, events):
         """ Find all the valid events """
+        # The events query is not narrowed to the task, the new notes of the whole
+        # site are fetched in a single query only returning the notes of the task
+        notes = self._find_entities('Note', [event['entity']['id'] for event in events],
+                                    ['id', 'subject', 'content', 'user', 'tasks', 'note_links'],
+                                    [['tasks', 'is', {'type': 'Task', 'id': self.task['id']}]])
         events_data = []
-        for event in self._find_events():
-            note = self.sg.find_one('Note',
-                                        filters=[
-                                            ['id', 'is', event['entity']['id']],
-                                            ['tasks', 'is', { 'type': 'Task', 'id': self.task['id'] }],
-                                        ],
-                                        fields=['id', 'subject', 'content', 'user', 'tasks', 'note_links']
-                                    )
+        for event in events:
+            note = notes.get(event['entity']['id'])
             if not note:
                 continue
+            # Cached notes may come from the sessions of other tasks
+            if not any(task['id'] == self.task['id'] for task in note['tasks'] or []):
+                continue
             events_data.append((event, note))
         return events_data
 
@@ -238,3 +627,8 @@ class NewNoteFilter(EventFilterBase):
             note_link = note_link[-1]['name']
         message = 'A new note by %s was added on %s' % (user, note_link)
         return Notification(message, self.get_url(note))
+
+    def _update_view(self, view, event_data):
+        """ Add the new note to the recent notes """
+        event, note = event_data
+        view.add_note(note)
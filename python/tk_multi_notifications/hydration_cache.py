@@ -0,0 +1,130 @@
+"""
+This module contains an on disk cache of the entities the filters
+fetch from Shotgun, shared by all the sessions of a user on a
+workstation so the same entity is only fetched once
+"""
+import os
+import time
+import json
+import sqlite3
+import threading
+
+
+def log(msg):
+    print time.strftime("%Y/%m/%d %H:%M:%S", time.localtime()) +": "+msg
+
+
+class HydrationCache(object):
+    """
+    SQLite cache of entities keyed by entity type and id. Entries expire
+    after ttl seconds and only the max_entries most recent ones are kept.
+    Every operation uses its own connection so the cache can be used from
+    several threads and processes at the same time. Errors are logged and
+    reported as cache misses, the cache is never required to get the data
+    """
+    def __init__(self, path, ttl=600, max_entries=10000):
+        super(HydrationCache, self).__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._hits = 0
+        self._misses = 0
+        self._stats_lock = threading.Lock()
+        # Set when the cache file cannot be created, the cache is then skipped
+        self._disabled = False
+        self._create_table()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    def _create_table(self):
+        """ Create the cache file and table if needed, disable the cache if it fails """
+        directory = os.path.dirname(self.path)
+        try:
+            if directory and not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Another session may have created it in the meantime
+                    if not os.path.isdir(directory):
+                        raise
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute('CREATE TABLE IF NOT EXISTS entities ('
+                                       'entity_type TEXT, entity_id INTEGER, data TEXT, stored_at REAL, '
+                                       'PRIMARY KEY (entity_type, entity_id))')
+                    # Every write evicts by age, do not sort the whole table to do it
+                    connection.execute('CREATE INDEX IF NOT EXISTS entities_stored_at ON entities (stored_at)')
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error) as error:
+            log('Hydration cache %s cannot be created, continuing without it: %s' % (self.path, error))
+            self._disabled = True
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def get(self, entity_type, entity_id, fields=None):
+        """
+        Return the cached entity data or None if it is not cached, expired or
+        does not hold all the provided fields
+        """
+        if self._disabled:
+            return None
+        data = None
+        try:
+            connection = self._connect()
+            try:
+                row = connection.execute('SELECT data FROM entities WHERE entity_type=? AND entity_id=? AND stored_at>=?',
+                                         (entity_type, entity_id, time.time() - self.ttl)).fetchone()
+            finally:
+                connection.close()
+            if row is not None:
+                data = json.loads(row[0])
+        except (sqlite3.Error, ValueError) as error:
+            log('Hydration cache read failed: %s' % error)
+        if data is not None and fields and not all(field in data for field in fields):
+            data = None
+        self._count(data is not None)
+        return data
+
+    def set(self, entity_type, entity_id, data):
+        """ Store the entity data and evict the expired and oldest entries """
+        if self._disabled:
+            return
+        try:
+            value = json.dumps(data)
+        except (TypeError, ValueError):
+            return
+        now = time.time()
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute('INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?)',
+                                       (entity_type, entity_id, value, now))
+                    connection.execute('DELETE FROM entities WHERE stored_at<?', (now - self.ttl,))
+                    connection.execute('DELETE FROM entities WHERE rowid IN '
+                                       '(SELECT rowid FROM entities ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+                                       (self.max_entries,))
+            finally:
+                connection.close()
+        except sqlite3.Error as error:
+            log('Hydration cache write failed: %s' % error)
+
+    def stats(self):
+        """ Return the hits, misses and hit rate of this session """
+        with self._stats_lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': float(self._hits) / lookups if lookups else 0.0,
+            }
@@ -11,6 +11,7 @@
 # by importing QT from sgtk rather than directly, we ensure that
 # the code will be compatible with both PySide and PyQt.
 
+import os
 import time
 import random
 from functools import partial
@@ -20,6 +21,12 @@ from events_filter import EventsFilter
 from events_filter import TaskStatusChangedFilter
 from events_filter import NewPublishFilter
 from events_filter import NewNoteFilter
+from events_filter import PRIORITY_URGENT
+from events_filter import PRIORITY_BULK
+from events_filter import PRIORITIES
+from webhook import WebhookReceiver
+from hydration_cache import HydrationCache
+from catchup import CatchUp
 from .ui import resources_rc
 
 import tank
@@ -39,17 +46,64 @@ class TankNotificationsService(object):
         # Get the task daa required
         task = self._find_task(self._app.context.task['id'])
         # Initialize the event filter instance
-        self._event_filter = EventsFilter(self._app.shotgun, task)
+        self._catchup = self._create_catchup()
+        # Every priority lane gets its own connection so the urgent one never waits for the bulk one
+        self._event_filter = EventsFilter(self._app.shotgun, task,
+                                          cache=self._create_cache(),
+                                          catchup=self._catchup,
+                                          connection_factory=tank.util.shotgun.create_sg_connection)
         self._event_filter.add_filter(TaskStatusChangedFilter)
         self._event_filter.add_filter(NewPublishFilter)
         self._event_filter.add_filter(NewNoteFilter)
+        for _filter in self._event_filter.filters():
+            _filter.backlog_threshold = self._app.get_setting('backlog_threshold')
         # Initialize the notification widget
         self._widget = TankNotificationWidget(self, self._event_filter)
+        # Receive the events from Shotgun webhooks instead of polling them if a port is configured
+        self._receiver = None
+        webhook_port = self._app.get_setting('webhook_port')
+        if webhook_port:
+            self._receiver = WebhookReceiver(self._event_filter,
+                                             host=self._app.get_setting('webhook_host'),
+                                             port=webhook_port,
+                                             secret=self._app.get_setting('webhook_secret'),
+                                             callback=self._widget.events_pushed.emit)
 
     def _find_task(self, task_id):
         """ Return the task data of of the provided task id """
         return self._app.shotgun.find_one("Task", filters=[['id', 'is', task_id]], fields=['id', 'entity'])
 
+    def _create_cache(self):
+        """ Return the hydration cache shared by all the sessions of the user, None if it is disabled """
+        ttl = self._app.get_setting('hydration_cache_ttl')
+        if not ttl:
+            return None
+        return HydrationCache(os.path.join(self._app.cache_location, 'hydration_cache.db'),
+                              ttl=ttl,
+                              max_entries=self._app.get_setting('hydration_cache_max_entries'))
+
+    def _create_catchup(self):
+        """ Return the parallel catch-up of the filters, None if it is disabled """
+        workers = self._app.get_setting('catchup_workers')
+        if workers < 2:
+            return None
+        shard_size = self._app.get_setting('catchup_shard_size')
+        if shard_size >= self._app.get_setting('backlog_threshold'):
+            log('catchup_shard_size must be smaller than backlog_threshold, the parallel catch-up is disabled.')
+            return None
+        # Every worker needs its own Shotgun connection
+        return CatchUp(tank.util.shotgun.create_sg_connection,
+                       workers=workers,
+                       shard_size=shard_size)
+
+    def stats(self):
+        """ Return the statistics of the service, like the hydration cache hit rate """
+        return self._event_filter.stats()
+
+    def task_view(self):
+        """ Return the local view of the task state, None if there is no task """
+        return self._event_filter.view
+
     def is_running(self):
         """ Return True if the service is running """
         if self._widget is None:
@@ -62,11 +116,26 @@ class TankNotificationsService(object):
         if self._app.context.task is None:
             log('The context is not valid. Notifications service cannot start.')
             return False
+        if self._receiver is not None:
+            if self._receiver.start():
+                self._event_filter.enable_push(self._app.get_setting('reconcile_interval'))
+                # Webhooks were not received while stopped, poll to catch up
+                self._event_filter.reconcile()
+            else:
+                log('Webhooks cannot be received, polling the events instead.')
+                self._event_filter.disable_push()
         self._widget.start()
         return self._widget._active
 
     def stop(self):
         log('Notifications service stopping ...')
+        log('Notifications service stats: %s' % self.stats())
+        if self._receiver is not None:
+            self._receiver.stop()
+        # The app is rebuilt on every context switch, do not leave the catch-up
+        # workers and connections behind. The next catch-up creates them again
+        if self._catchup is not None:
+            self._catchup.close()
         self._widget.stop()
         return self._widget._active
 
@@ -90,20 +159,27 @@ class ClickableLabel(QtGui.QLabel):
 
 class TankNotificationWidget(QtGui.QWidget):
     """ Widget displaying the notifications """
+    # Emitted from the webhook receiver thread with the priority of the lane that got new events
+    events_pushed = QtCore.Signal(str)
+
     def __init__(self, parent, event_filter):
         super(TankNotificationWidget, self).__init__()
         self.setWindowFlags(QtCore.Qt.FramelessWindowHint | QtCore.Qt.WindowStaysOnTopHint)
-        self._timer = None
-        self._timer_delay = 5000
         self._active = False
         self.parent = parent
+        self._timers = {}
+        # Urgent events are polled often, bulk events are batched in a digest
+        self._timer_delays = {
+            PRIORITY_URGENT: self._app.get_setting('urgent_poll_interval') * 1000,
+            PRIORITY_BULK: self._app.get_setting('bulk_poll_interval') * 1000,
+        }
         self._url = self.get_default_url()
         self._event_filter = event_filter
         self._message_displaying = False
         self.create_layout()
         self.create_connections()
-        # Start a timer that will check for new notifications when the timer runs out
-        self.create_timer()
+        # Start a timer per priority lane that will check for new notifications when the timer runs out
+        self.create_timers()
 
     @property
     def _app(self):
@@ -132,6 +208,7 @@ class TankNotificationWidget(QtGui.QWidget):
     def create_connections(self):
         """ Create the connections of this widget """
         self.logo.clicked.connect(self.open_shotgun)
+        self.events_pushed.connect(self.on_events_pushed)
 
     def start(self):
         """
@@ -139,7 +216,8 @@ class TankNotificationWidget(QtGui.QWidget):
         of notification check > start a timer > notification check > etc
         """
         self._active = True
-        self.check_for_notifications()
+        for priority in PRIORITIES:
+            self.check_for_notifications(priority)
 
     def stop(self):
         """ Set the self._active member value False,
@@ -148,32 +226,44 @@ class TankNotificationWidget(QtGui.QWidget):
         """
         self._active = False
 
-    def create_timer(self):
-        """ Create a timer that check for new notifications when it runs out """
-        self._timer = QtCore.QTimer()
-        self._timer.setSingleShot(True)
-        self._timer.timeout.connect(self.check_for_notifications)
-
-    def start_timer(self, delay):
-        """ Start the timer with the provided delay """
-        if self._message_displaying:
+    def create_timers(self):
+        """ Create a timer per priority lane that check for new notifications when it runs out """
+        for priority in PRIORITIES:
+            timer = QtCore.QTimer()
+            timer.setSingleShot(True)
+            timer.timeout.connect(partial(self.check_for_notifications, priority))
+            self._timers[priority] = timer
+
+    def start_timer(self, priority, delay=None):
+        """ Start the timer of the provided priority lane, with its own delay if none is provided """
+        if delay is None:
+            delay = self._timer_delays[priority]
+        # Urgent events keep being polled while a message is displayed so they
+        # can replace it right away, the other lanes wait for the message to close
+        waiting = self._message_displaying and priority != PRIORITY_URGENT
+        if waiting:
             print 'Message is being displayed. Waiting for the message to close.'
-        if self._active and not self._message_displaying:
-            print 'Starting timer....'
-            self._timer.start(delay)
+        if self._active and not waiting:
+            print 'Starting %s timer....' % priority
+            self._timers[priority].start(delay)
+
+    @QtCore.Slot(str)
+    def on_events_pushed(self, priority):
+        """ Check the lane that received pushed events right away instead of waiting for its timer """
+        self.start_timer(priority, 0)
 
-    def check_for_notifications(self):
-        """ Launch a thread that will query Shotgun to get notifications and display them """
+    def check_for_notifications(self, priority):
+        """ Launch a thread that will query Shotgun to get notifications of the provided priority and display them """
         if not self._active:
             return
-        thread = NotificationThread(self)
+        thread = NotificationThread(self, priority)
         # This connection will show a notification message if a notification
         # is found by the thread
         thread.notification_url.connect(self.set_url)
         thread.notification_message.connect(self.show_message)
         # When the thread is finished, start a new timer that will
         # execute this method again at the end of the timer
-        thread.finished.connect(partial(self.start_timer, self._timer_delay))
+        thread.finished.connect(partial(self.start_timer, priority))
         # Start the thread
         thread.start()
 
@@ -236,8 +326,9 @@ class TankNotificationWidget(QtGui.QWidget):
         if event.button() == QtCore.Qt.RightButton:
             self.close()
             self._message_displaying = False
-            # Start a new timer when the message is closed
-            self.start_timer(1000)
+            # Start new timers when the message is closed
+            for priority in PRIORITIES:
+                self.start_timer(priority, 1000)
 
 
 class NotificationThread(QtCore.QThread):
@@ -245,34 +336,46 @@ class NotificationThread(QtCore.QThread):
     notification_message = QtCore.Signal(unicode)
     notification_url = QtCore.Signal(unicode)
 
-    def __init__(self, parent):
+    def __init__(self, parent, priority):
         super(NotificationThread, self).__init__(parent)
         self.parent = parent
+        self.priority = priority
 
     def start(self):
-        log('Starting thread...')
+        log('Starting %s thread...' % self.priority)
         super(NotificationThread, self).start()
         self.setPriority(QtCore.QThread.LowPriority)
 
     def run(self):
-        # Run the event filter
-        self.parent._event_filter.run()
-        # loop all filters results
+        # Run the event filters of this thread priority lane
+        filters = self.parent._event_filter.run(self.priority)
+        # loop all filters results. Filters that were far behind only hydrated
+        # their most recent events, the ones that may have more are marked with a +
         notifications = []
-        for _filter in self.parent._event_filter.filters():
-            for notification in _filter.get_notifications():
-                notifications.append(notification)
+        counts = []
+        backlog = False
+        more = False
+        total = 0
+        for _filter in filters:
+            notifications.extend(_filter.get_notifications())
+            counts.append('%s: %d%s' % (_filter.digest_name, _filter.count(), '+' if _filter.more() else ''))
+            backlog = backlog or _filter.backlog is not None
+            more = more or _filter.more()
+            total += _filter.count()
 
         # Return if we got nothing
-        if not notifications:
+        if not total:
             return
 
         # Show the message or the number of notification since the last update
-        if len(notifications) == 1:
+        if total == 1 and notifications and not more:
             msg = notifications[0].get_message()
             url = notifications[0].get_url()
         else:
-            msg = '%d new activity in task %s' % (len(notifications), self.parent.context.task['name'])
+            msg = '%d%s new activity in task %s' % (total, '+' if more else '', self.parent.context.task['name'])
+            # Bulk and backlog notifications are delivered as a digest of what was found
+            if self.priority == PRIORITY_BULK or backlog:
+                msg += ' (%s)' % ', '.join(counts)
             url = ''
         # Emit the url first because the message emit will show the notification widget
         self.notification_url.emit(url)
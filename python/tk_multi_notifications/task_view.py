@@ -0,0 +1,117 @@
+"""
+This module contains a local view of the watched task state,
+seeded from Shotgun once and then kept up to date from the
+events found by the events filters
+"""
+import copy
+import threading
+
+
+class TaskView(object):
+    """
+    In memory view of a task and its entity: the task status, the latest
+    publish of every publish type on the entity and the recent notes of the task.
+    It can be read from any thread without querying Shotgun
+    """
+    max_notes = 20
+
+    def __init__(self, shotgun_api, task):
+        super(TaskView, self).__init__()
+        self.sg = shotgun_api
+        self.task = task
+        self._lock = threading.Lock()
+        # Status code to name map, fetched on the first seed
+        self.statuses = None
+        self._status = None
+        self._status_name = ''
+        self._publishes = {}
+        self._notes = []
+
+    def seed(self, sg=None):
+        """
+        Fill the view with a few bulk queries. sg is the connection
+        to use when seeding from another thread
+        """
+        sg = sg or self.sg
+        if self.statuses is None:
+            self.statuses = dict((status['code'], status['name']) for status in
+                                 sg.find('Status', filters=[], fields=['name', 'code']))
+        statuses = self.statuses
+        task = sg.find_one('Task', filters=[['id', 'is', self.task['id']]], fields=['sg_status_list'])
+        publishes = []
+        if self.task['entity']:
+            publishes = self._find_latest_publishes(sg)
+        notes = sg.find('Note',
+                        filters=[['tasks', 'is', {'type': 'Task', 'id': self.task['id']}]],
+                        fields=['id', 'subject', 'content', 'user', 'tasks', 'note_links'],
+                        order=[{'column': 'id', 'direction': 'desc'}],
+                        limit=self.max_notes)
+        notes.reverse()
+        with self._lock:
+            self._status = task['sg_status_list'] if task else None
+            self._status_name = statuses.get(self._status, '')
+            self._publishes = {}
+            self._notes = []
+        for publish in publishes:
+            self.add_publish(publish)
+        for note in notes:
+            self.add_note(note)
+
+    def _find_latest_publishes(self, sg):
+        """ Return the latest publish of every publish type on the task entity """
+        # Get the id of the latest publish of every type, then only fetch those
+        summary = sg.summarize('PublishedFile',
+                               filters=[['entity', 'is', self.task['entity']]],
+                               summary_fields=[{'field': 'id', 'type': 'maximum'}],
+                               grouping=[{'field': 'published_file_type', 'type': 'exact', 'direction': 'asc'}])
+        publish_ids = [group['summaries']['id'] for group in summary['groups']]
+        if not publish_ids:
+            return []
+        return sg.find('PublishedFile',
+                       filters=[['id', 'in', publish_ids]],
+                       fields=['id', 'published_file_type', 'code', 'entity'],
+                       order=[{'column': 'id', 'direction': 'asc'}])
+
+    def set_status(self, code, name):
+        """ Set the current task status """
+        with self._lock:
+            self._status = code
+            self._status_name = name
+
+    def add_publish(self, publish):
+        """ Store the publish if it is the latest one of its type """
+        publish_type = publish['published_file_type']
+        key = publish_type['name'] if publish_type else None
+        with self._lock:
+            latest = self._publishes.get(key)
+            if latest is None or latest['id'] < publish['id']:
+                self._publishes[key] = publish
+
+    def add_note(self, note):
+        """ Add a note to the recent notes, only keeping the max_notes most recent ones """
+        with self._lock:
+            if any(known['id'] == note['id'] for known in self._notes):
+                return
+            self._notes.append(note)
+            self._notes.sort(key=lambda known: known['id'])
+            del self._notes[:-self.max_notes]
+
+    def status(self):
+        """ Return the task status code """
+        with self._lock:
+            return self._status
+
+    def status_name(self):
+        """ Return the task status name """
+        with self._lock:
+            return self._status_name
+
+    def latest_publishes(self):
+        """ Return a dict of publish type name to the latest publish of that type """
+        with self._lock:
+            return copy.deepcopy(self._publishes)
+
+    def recent_notes(self):
+        """ Return the recent notes of the task, the most recent one last """
+        with self._lock:
+            return copy.deepcopy(self._notes)
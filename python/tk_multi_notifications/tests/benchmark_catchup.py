@@ -0,0 +1,58 @@
+"""
+Measure the catch-up throughput with different numbers of workers,
+against the fake shotgun with a per request latency. The gap is the
+largest catch-up the default settings run, the events of the filter
+are mixed with other site traffic. With the default shard size the
+gap is only 10 shards, the workers cannot go faster than the number
+of rounds of shards they need: 10, 5, 3 and 2 rounds for 1, 2, 4 and
+8 workers. Smaller shards show the scaling past 4 workers
+"""
+import os
+import sys
+import time
+
+# add path to be able to import the modules we need for the tests
+paths = [
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+    os.path.abspath(os.path.dirname(__file__)),
+]
+for path in paths:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from fake_shotgun import FakeShotgun
+from catchup import CatchUp
+
+LATENCY = 0.05
+# Just under the default backlog_threshold
+EVENTS = 4999
+# The default catchup_shard_size and a quarter of it
+SHARD_SIZES = (500, 125)
+# One event out of PUBLISH_RATIO is a publish
+PUBLISH_RATIO = 5
+
+
+def benchmark(workers, shard_size):
+    """ Return the number of event ids per second covered by the catch-up """
+    sg = FakeShotgun(latency=LATENCY)
+    for i in range(EVENTS):
+        if i % PUBLISH_RATIO:
+            sg.add_event('Shotgun_Shot_Change', {'type': 'Shot', 'id': 1})
+        else:
+            sg.add_event('Shotgun_PublishedFile_New', {'type': 'PublishedFile', 'id': i + 1})
+    catchup = CatchUp(sg.connection, workers=workers, shard_size=shard_size)
+    start = time.time()
+    events, fetched_id = catchup.fetch('EventLogEntry', [['event_type', 'is', 'Shotgun_PublishedFile_New']],
+                                       ['id'], 1, EVENTS)
+    elapsed = time.time() - start
+    catchup.close()
+    assert [event['id'] for event in events] == range(1, EVENTS + 1, PUBLISH_RATIO)
+    assert fetched_id == EVENTS
+    return EVENTS / elapsed
+
+
+if __name__ == '__main__':
+    for shard_size in SHARD_SIZES:
+        print 'Catch-up of %d event ids in shards of %d, %dms per request' % (EVENTS, shard_size, LATENCY * 1000)
+        for workers in (1, 2, 4, 8):
+            print '%d workers: %d event ids/s' % (workers, benchmark(workers, shard_size))
@@ -0,0 +1,168 @@
+"""
+In memory stand-in for the shotgun_api3.Shotgun class.
+It only implements the queries and filter operators used by the
+events filters so they can be tested without a Shotgun server
+"""
+import time
+import itertools
+
+
+class FakeConfig(object):
+    """ Mimic the Shotgun config object """
+    def __init__(self, server):
+        super(FakeConfig, self).__init__()
+        self.server = server
+
+
+class FakeShotgun(object):
+    """ Fake Shotgun connection storing the entities in memory """
+    def __init__(self, server='fake.shotgunstudio.com', latency=0):
+        super(FakeShotgun, self).__init__()
+        self.config = FakeConfig(server)
+        # Seconds every query waits for, to mimic the network round trip
+        self.latency = latency
+        self._entities = {}
+        self._ids = itertools.count(1)
+        # Every query made to the fake backend, as (method, entity_type) tuples
+        self.calls = []
+        self.closed = False
+
+    def connection(self):
+        """ Return another connection to the same fake database, like a new Shotgun instance would """
+        connection = FakeShotgun(self.config.server, self.latency)
+        connection._entities = self._entities
+        connection._ids = self._ids
+        connection.calls = self.calls
+        return connection
+
+    def close(self):
+        """ Mark the connection as closed, it can still be used like a real one would reconnect """
+        self.closed = True
+
+    def create(self, entity_type, data):
+        """ Store a new entity and return it """
+        entity = dict(data)
+        entity['type'] = entity_type
+        entity['id'] = next(self._ids)
+        if entity_type == 'EventLogEntry':
+            entity.setdefault('created_at', entity['id'])
+        self._entities.setdefault(entity_type, {})[entity['id']] = entity
+        return entity
+
+    def add_event(self, event_type, entity, attribute_name=None, meta=None):
+        """ Shortcut creating an EventLogEntry """
+        return self.create('EventLogEntry', {
+            'event_type': event_type,
+            'entity': entity,
+            'attribute_name': attribute_name,
+            'meta': meta or {},
+        })
+
+    def find(self, entity_type, filters, fields=None, order=None, filter_operator=None, limit=0):
+        """ Return all the entities of the provided type matching the filters """
+        self.calls.append(('find', entity_type))
+        time.sleep(self.latency)
+        entities = [entity for entity in self._candidates(entity_type, filters, filter_operator)
+                    if self._match(entity, filters, filter_operator)]
+        for _order in reversed(order or [{'column': 'id', 'direction': 'asc'}]):
+            entities.sort(key=lambda entity: entity.get(_order['column']),
+                          reverse=_order.get('direction') == 'desc')
+        if limit:
+            entities = entities[:limit]
+        return [self._fields(entity, fields) for entity in entities]
+
+    def find_one(self, entity_type, filters, fields=None, order=None, filter_operator=None):
+        """ Return the first entity matching the filters or None """
+        results = self.find(entity_type, filters, fields=fields, order=order,
+                            filter_operator=filter_operator, limit=1)
+        self.calls[-1] = ('find_one', entity_type)
+        return results[0] if results else None
+
+    def summarize(self, entity_type, filters, summary_fields, filter_operator=None, grouping=None):
+        """
+        Summarize the entities matching the filters. Only the count and maximum
+        summary types and a single level of exact grouping are supported
+        """
+        self.calls.append(('summarize', entity_type))
+        time.sleep(self.latency)
+        entities = [entity for entity in self._candidates(entity_type, filters, filter_operator)
+                    if self._match(entity, filters, filter_operator)]
+        result = {'summaries': self._summaries(entities, summary_fields), 'groups': []}
+        if grouping:
+            field = grouping[0]['field']
+            groups = {}
+            for entity in entities:
+                value = entity.get(field)
+                key = (value.get('type'), value.get('id')) if isinstance(value, dict) else value
+                groups.setdefault(key, (value, []))[1].append(entity)
+            for key in sorted(groups, reverse=grouping[0].get('direction') == 'desc'):
+                value, group_entities = groups[key]
+                result['groups'].append({
+                    'group_value': value,
+                    'summaries': self._summaries(group_entities, summary_fields),
+                })
+        return result
+
+    def _candidates(self, entity_type, filters, filter_operator):
+        """
+        Return the entities the filters have to be checked on. Like the id index of a
+        real database, an id range filter only looks up the ids of the range
+        """
+        entities = self._entities.get(entity_type, {})
+        if filter_operator != 'any':
+            for field, operator, value in filters:
+                if field == 'id' and operator == 'between':
+                    return [entities[_id] for _id in range(value[0], value[1] + 1) if _id in entities]
+        return entities.values()
+
+    def _summaries(self, entities, summary_fields):
+        """ Return the summaries of the provided entities """
+        summaries = {}
+        for summary_field in summary_fields:
+            if summary_field['type'] == 'count':
+                summaries[summary_field['field']] = len(entities)
+            elif summary_field['type'] == 'maximum':
+                summaries[summary_field['field']] = max([entity.get(summary_field['field']) for entity in entities] or [None])
+            else:
+                raise ValueError('Unsupported summary type %s' % summary_field['type'])
+        return summaries
+
+    def _fields(self, entity, fields):
+        """ Return a copy of the entity only containing the requested fields """
+        result = {'type': entity['type'], 'id': entity['id']}
+        for field in fields or []:
+            result[field] = entity.get(field)
+        return result
+
+    def _match(self, entity, filters, filter_operator):
+        """ Return True if the entity matches the filters """
+        matches = [self._match_filter(entity, _filter) for _filter in filters]
+        if filter_operator == 'any':
+            return any(matches)
+        return all(matches)
+
+    def _match_filter(self, entity, _filter):
+        """ Return True if the entity matches a single [field, operator, value] filter """
+        field, operator, value = _filter
+        entity_value = entity.get(field)
+        if operator == 'is':
+            if isinstance(entity_value, list):
+                return any(self._equal(item, value) for item in entity_value)
+            return self._equal(entity_value, value)
+        if operator == 'is_not':
+            return not self._equal(entity_value, value)
+        if operator == 'in':
+            return any(self._equal(entity_value, item) for item in value)
+        if operator == 'greater_than':
+            return entity_value > value
+        if operator == 'less_than':
+            return entity_value < value
+        if operator == 'between':
+            return value[0] <= entity_value <= value[1]
+        raise ValueError('Unsupported filter operator %s' % operator)
+
+    def _equal(self, entity_value, value):
+        """ Compare two field values, entities are compared on their type and id """
+        if isinstance(entity_value, dict) and isinstance(value, dict):
+            return entity_value.get('type') == value.get('type') and entity_value.get('id') == value.get('id')
+        return entity_value == value
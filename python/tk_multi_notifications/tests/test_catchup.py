@@ -0,0 +1,118 @@
+import os
+import sys
+
+# add path to be able to import the modules we need for the tests
+paths = [
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+    os.path.abspath(os.path.dirname(__file__)),
+]
+for path in paths:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from fake_shotgun import FakeShotgun
+from catchup import CatchUp
+from catchup import shard_ranges
+from events_filter import EventsFilter
+from events_filter import NewPublishFilter
+from test_events_filters_offline import setup_shotgun
+from test_events_filters_offline import add_publish
+
+
+class FailingShotgun(FakeShotgun):
+    """ Fake shotgun failing the queries of the events starting at fail_id """
+    fail_id = None
+
+    def find(self, entity_type, filters, *args, **kwargs):
+        if self.fail_id is not None and ['id', 'between', [self.fail_id, self.fail_id + 9]] in filters:
+            raise IOError('Connection reset')
+        return super(FailingShotgun, self).find(entity_type, filters, *args, **kwargs)
+
+
+def test_shard_ranges():
+    assert shard_ranges(1, 25, 10) == [(1, 10), (11, 20), (21, 25)]
+    assert shard_ranges(5, 5, 10) == [(5, 5)]
+
+
+def test_catchup_ordered_merge():
+    sg, task, other_task = setup_shotgun()
+    sg.latency = 0.01
+    publish_filter = EventsFilter(sg, task, [NewPublishFilter],
+                                  catchup=CatchUp(lambda: sg, workers=4, shard_size=10)).filters()[0]
+    events = [add_publish(sg, task['entity'], 'comp_v%03d' % i) for i in range(40)]
+    del sg.calls[:]
+
+    assert publish_filter.find(events[-1]['id'])
+    # 80 ids behind in shards of 10 ids, merged back in id order
+    assert sg.calls.count(('find', 'EventLogEntry')) == 8
+    messages = [n.get_message().split('"')[1] for n in publish_filter.get_notifications()]
+    assert messages == ['comp_v%03d' % i for i in range(40)]
+    assert publish_filter.last_event_id == events[-1]['id']
+
+
+def test_catchup_contiguous_cursor():
+    sg, task, other_task = setup_shotgun(FailingShotgun())
+    publish_filter = EventsFilter(sg, task, [NewPublishFilter],
+                                  catchup=CatchUp(lambda: sg, workers=4, shard_size=10)).filters()[0]
+    start_id = publish_filter.last_event_id
+    events = [add_publish(sg, task['entity'], 'comp_v%03d' % i) for i in range(40)]
+
+    # The third shard fails, only the first two are delivered and the cursor stops before it
+    sg.fail_id = start_id + 21
+    publish_filter.find(events[-1]['id'])
+    assert publish_filter.last_event_id == start_id + 20
+    assert len(publish_filter.get_notifications()) == 10
+
+    # The next run fetches the rest, nothing is delivered twice
+    sg.fail_id = None
+    publish_filter.find(events[-1]['id'])
+    assert publish_filter.last_event_id == events[-1]['id']
+    assert len(publish_filter.get_notifications()) == 30
+
+
+def test_catchup_keeps_connections():
+    sg, task, other_task = setup_shotgun()
+    connections = []
+
+    def connection_factory():
+        connections.append(sg.connection())
+        return connections[-1]
+
+    catchup = CatchUp(connection_factory, workers=2, shard_size=10)
+    for i in range(3):
+        catchup.fetch('EventLogEntry', [], ['id'], 1, 40)
+    assert len(connections) <= 2
+
+
+def test_catchup_close():
+    sg, task, other_task = setup_shotgun()
+    connections = []
+
+    def connection_factory():
+        connections.append(sg.connection())
+        return connections[-1]
+
+    catchup = CatchUp(connection_factory, workers=2, shard_size=10)
+    catchup.fetch('EventLogEntry', [], ['id'], 1, 40)
+    pool = catchup._pool
+    catchup.close()
+    # The workers exit and their connections are closed
+    for worker in pool._pool:
+        worker.join(5)
+        assert not worker.is_alive()
+    assert connections and all(connection.closed for connection in connections)
+
+    # The next catch-up creates a new pool and new connections
+    events, fetched_id = catchup.fetch('EventLogEntry', [], ['id'], 1, 40)
+    assert fetched_id == 40
+    assert catchup._pool is not pool
+    assert not connections[-1].closed
+    catchup.close()
+
+
+if __name__ == '__main__':
+    test_shard_ranges()
+    test_catchup_ordered_merge()
+    test_catchup_contiguous_cursor()
+    test_catchup_keeps_connections()
+    test_catchup_close()
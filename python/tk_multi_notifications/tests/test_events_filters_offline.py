@@ -0,0 +1,264 @@
+import os
+import sys
+import time
+import threading
+
+# add path to be able to import the modules we need for the tests
+paths = [
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+    os.path.abspath(os.path.dirname(__file__)),
+]
+for path in paths:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from fake_shotgun import FakeShotgun
+from events_filter import EventsFilter
+from events_filter import TaskStatusChangedFilter
+from events_filter import NewPublishFilter
+from events_filter import NewNoteFilter
+from events_filter import PRIORITY_URGENT
+from events_filter import PRIORITY_BULK
+
+
+def setup_shotgun(sg=None):
+    """ Return a fake shotgun populated with a shot, its task and a few statuses """
+    if sg is None:
+        sg = FakeShotgun()
+    sg.create('Status', {'code': 'ip', 'name': 'In Progress'})
+    sg.create('Status', {'code': 'fin', 'name': 'Final'})
+    shot = sg.create('Shot', {'name': 'sh010'})
+    shot_link = {'type': 'Shot', 'id': shot['id'], 'name': 'sh010'}
+    task = sg.create('Task', {'content': 'comp', 'entity': shot_link})
+    other_task = sg.create('Task', {'content': 'anim', 'entity': shot_link})
+    # The events filter needs at least one event to initialize its cursor
+    sg.add_event('Shotgun_Shot_New', shot_link)
+    task = sg.find_one('Task', filters=[['id', 'is', task['id']]], fields=['id', 'entity'])
+    return sg, task, other_task
+
+
+def create_events_filter(sg, task):
+    event_filter = EventsFilter(sg, task)
+    event_filter.add_filter(TaskStatusChangedFilter)
+    event_filter.add_filter(NewPublishFilter)
+    event_filter.add_filter(NewNoteFilter)
+    return event_filter
+
+
+def add_status_change(sg, task, code):
+    return sg.add_event('Shotgun_Task_Change', {'type': 'Task', 'id': task['id'], 'name': 'comp'},
+                        attribute_name='sg_status_list', meta={'new_value': code})
+
+
+def add_publish(sg, entity, code):
+    publish = sg.create('PublishedFile', {'code': code, 'entity': entity, 'published_file_type': None})
+    return sg.add_event('Shotgun_PublishedFile_New', {'type': 'PublishedFile', 'id': publish['id']})
+
+
+def test_priority_lanes():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    add_status_change(sg, task, 'ip')
+    add_status_change(sg, other_task, 'fin')
+    add_publish(sg, task['entity'], 'comp_v001')
+
+    # The urgent lane only runs the urgent filters and narrows the status query to the task
+    found = event_filter.run(PRIORITY_URGENT)
+    assert [type(f) for f in found] == [TaskStatusChangedFilter]
+    notifications = found[0].get_notifications()
+    assert len(notifications) == 1
+    assert 'In Progress' in notifications[0].get_message()
+
+    # The bulk lane still gets the publish created before the urgent run
+    found = event_filter.run(PRIORITY_BULK)
+    assert [type(f) for f in found] == [NewPublishFilter]
+    assert len(found[0].get_notifications()) == 1
+
+
+def test_lanes_do_not_double_count():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    add_status_change(sg, task, 'ip')
+    add_publish(sg, task['entity'], 'comp_v001')
+    assert len(event_filter.run(PRIORITY_URGENT)) == 1
+    assert len(event_filter.run(PRIORITY_BULK)) == 1
+    # Nothing new, nothing found again by either lane
+    assert event_filter.run(PRIORITY_URGENT) == []
+    assert event_filter.run(PRIORITY_BULK) == []
+    assert event_filter.run() == []
+    # The shared cursor followed the newest event fetched
+    add_publish(sg, task['entity'], 'comp_v002')
+    found = event_filter.run()
+    assert [type(f) for f in found] == [NewPublishFilter]
+    assert event_filter.last_event_id == found[0].last_event_id
+
+
+def test_urgent_lane_does_not_wait_for_bulk():
+    sg, task, other_task = setup_shotgun()
+    connections = {}
+
+    def connection_factory():
+        connection = sg.connection()
+        connections[len(connections)] = connection
+        return connection
+
+    event_filter = EventsFilter(sg, task, [TaskStatusChangedFilter, NewPublishFilter],
+                                connection_factory=connection_factory)
+    # The urgent filter was added first, slow down the bulk lane connection only
+    connections[1].latency = 0.5
+    add_publish(sg, task['entity'], 'comp_v001')
+    add_status_change(sg, task, 'ip')
+    bulk = threading.Thread(target=event_filter.run, args=(PRIORITY_BULK,))
+    bulk.start()
+    time.sleep(0.1)
+    start = time.time()
+    found = event_filter.run(PRIORITY_URGENT)
+    assert time.time() - start < 0.4
+    assert [type(f) for f in found] == [TaskStatusChangedFilter]
+    bulk.join()
+
+
+def test_site_traffic_is_not_a_backlog():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    # Unrelated events between the polls move every cursor along with the newest event
+    for i in range(6):
+        for j in range(100):
+            sg.add_event('Shotgun_Shot_Change', task['entity'], attribute_name='description')
+        event_filter.run()
+    assert ('summarize', 'EventLogEntry') not in sg.calls
+    assert all(f.last_event_id == event_filter.last_event_id for f in event_filter.filters())
+
+
+def test_backlog_summarize():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    publish_filter = event_filter.filters(PRIORITY_BULK)[0]
+    publish_filter.backlog_threshold = 20
+    publish_filter.backlog_hydrate_count = 3
+    for i in range(30):
+        add_publish(sg, task['entity'], 'comp_v%03d' % i)
+    del sg.calls[:]
+
+    found = event_filter.run(PRIORITY_BULK)
+    assert found == [publish_filter]
+    # Only the most recent events are hydrated, the older ones are only counted
+    assert publish_filter.count() == 3
+    assert publish_filter.more()
+    notifications = publish_filter.get_notifications()
+    assert [n.get_message().split('"')[1] for n in notifications] == ['comp_v027', 'comp_v028', 'comp_v029']
+    assert sg.calls.count(('find_one', 'PublishedFile')) == 3
+    assert ('summarize', 'EventLogEntry') in sg.calls
+
+    # The cursor moved past the backlog, the next run is back to normal
+    add_publish(sg, task['entity'], 'comp_v030')
+    assert event_filter.run(PRIORITY_BULK) == [publish_filter]
+    assert publish_filter.backlog is None
+    assert publish_filter.count() == 1
+    assert not publish_filter.more()
+
+
+def test_backlog_only_counts_task_events():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    for _filter in event_filter.filters():
+        _filter.backlog_threshold = 20
+    other_shot = {'type': 'Shot', 'id': sg.create('Shot', {'name': 'sh020'})['id'], 'name': 'sh020'}
+    for i in range(30):
+        add_publish(sg, other_shot, 'anim_v%03d' % i)
+    # Nothing on the task, nothing to report
+    assert event_filter.run() == []
+
+    # The status query is narrowed to the task, its summary count is exact
+    for i in range(30):
+        add_status_change(sg, task, 'ip')
+        add_status_change(sg, other_task, 'fin')
+    found = event_filter.run(PRIORITY_URGENT)
+    assert [type(f) for f in found] == [TaskStatusChangedFilter]
+    assert found[0].count() == 30
+    assert len(found[0].get_notifications()) == 10
+
+
+def test_note_hydration_is_narrowed():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    user = {'type': 'HumanUser', 'id': 1, 'name': 'sup'}
+    for _task in [other_task] * 5 + [task]:
+        note = sg.create('Note', {'subject': 'notes', 'content': 'fix it', 'user': user,
+                                  'tasks': [{'type': 'Task', 'id': _task['id']}], 'note_links': [task['entity']]})
+        sg.add_event('Shotgun_Note_New', {'type': 'Note', 'id': note['id']})
+    del sg.calls[:]
+
+    # The new notes of the site are fetched in one query, only returning the notes of the task
+    found = event_filter.run(PRIORITY_URGENT)
+    assert [type(f) for f in found] == [NewNoteFilter]
+    assert [data[1]['id'] for data in found[0].events] == [note['id']]
+    assert sg.calls.count(('find', 'Note')) == 1
+    assert ('find_one', 'Note') not in sg.calls
+
+
+def test_task_view():
+    sg, task, other_task = setup_shotgun()
+    sg._entities['Task'][task['id']]['sg_status_list'] = 'ip'
+    render = {'type': 'PublishedFileType', 'id': 1, 'name': 'Render'}
+    for code in ('comp_v001', 'comp_v002'):
+        old_publish = sg.create('PublishedFile', {'code': code, 'entity': task['entity'], 'published_file_type': None})
+    render_publish = sg.create('PublishedFile', {'code': 'comp_exr', 'entity': task['entity'], 'published_file_type': render})
+    del sg.calls[:]
+    event_filter = create_events_filter(sg, task)
+    view = event_filter.view
+    # Seeded from the existing data, only fetching the latest publish of every type
+    assert view.status_name() == 'In Progress'
+    assert view.latest_publishes()[None]['id'] == old_publish['id']
+    assert view.latest_publishes()['Render']['id'] == render_publish['id']
+    assert sg.calls.count(('find', 'PublishedFile')) == 1
+    assert view.recent_notes() == []
+
+    add_status_change(sg, task, 'fin')
+    sg._entities['Task'][task['id']]['sg_status_list'] = 'fin'
+    add_publish(sg, task['entity'], 'comp_v003')
+    note = sg.create('Note', {'subject': 'notes', 'content': 'fix it', 'user': {'type': 'HumanUser', 'id': 1, 'name': 'sup'},
+                              'tasks': [{'type': 'Task', 'id': task['id']}], 'note_links': [task['entity']]})
+    sg.add_event('Shotgun_Note_New', {'type': 'Note', 'id': note['id']})
+    event_filter.run()
+
+    # Updated from the events, reading the view does not query shotgun
+    del sg.calls[:]
+    assert view.status() == 'fin'
+    assert view.status_name() == 'Final'
+    assert view.latest_publishes()[None]['code'] == 'comp_v003'
+    assert [n['id'] for n in view.recent_notes()] == [note['id']]
+    assert sg.calls == []
+
+    # Seeding again, after a backlog, does not fetch the statuses again
+    view.seed()
+    assert ('find', 'Status') not in sg.calls
+    assert view.status_name() == 'Final'
+
+
+def test_task_view_after_backlog():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    publish_filter = event_filter.filters(PRIORITY_BULK)[0]
+    publish_filter.backlog_threshold = 20
+    other_shot = {'type': 'Shot', 'id': sg.create('Shot', {'name': 'sh020'})['id'], 'name': 'sh020'}
+    add_publish(sg, task['entity'], 'comp_v001')
+    for i in range(30):
+        add_publish(sg, other_shot, 'anim_v%03d' % i)
+
+    # None of the hydrated events are on the task, the view is seeded again for the older ones
+    assert event_filter.run(PRIORITY_BULK) == []
+    assert publish_filter.more()
+    assert event_filter.view.latest_publishes()[None]['code'] == 'comp_v001'
+
+
+if __name__ == '__main__':
+    test_priority_lanes()
+    test_lanes_do_not_double_count()
+    test_urgent_lane_does_not_wait_for_bulk()
+    test_site_traffic_is_not_a_backlog()
+    test_backlog_summarize()
+    test_backlog_only_counts_task_events()
+    test_note_hydration_is_narrowed()
+    test_task_view()
+    test_task_view_after_backlog()
@@ -0,0 +1,100 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+
+# add path to be able to import the modules we need for the tests
+paths = [
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+    os.path.abspath(os.path.dirname(__file__)),
+]
+for path in paths:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from hydration_cache import HydrationCache
+from events_filter import EventsFilter
+from events_filter import TaskStatusChangedFilter
+from events_filter import NewPublishFilter
+from events_filter import NewNoteFilter
+from test_events_filters_offline import setup_shotgun
+from test_events_filters_offline import add_status_change
+from test_events_filters_offline import add_publish
+
+
+def create_session(sg, task, cache_path):
+    """ Return the events filter of a new DCC session using the cache file """
+    return EventsFilter(sg, task, [TaskStatusChangedFilter, NewPublishFilter, NewNoteFilter],
+                        cache=HydrationCache(cache_path))
+
+
+def test_sessions_share_cache():
+    directory = tempfile.mkdtemp()
+    try:
+        cache_path = os.path.join(directory, 'cache', 'hydration_cache.db')
+        sg, task, other_task = setup_shotgun()
+        first_session = create_session(sg, task, cache_path)
+        second_session = create_session(sg, task, cache_path)
+        add_status_change(sg, task, 'ip')
+        add_publish(sg, task['entity'], 'comp_v001')
+
+        del sg.calls[:]
+        assert len(first_session.run()) == 2
+        assert sg.calls.count(('find_one', 'PublishedFile')) == 1
+        assert first_session.stats()['cache']['hits'] == 0
+
+        # The second session finds the same events without fetching the entities again
+        del sg.calls[:]
+        found = second_session.run()
+        assert len(found) == 2
+        assert sg.calls.count(('find_one', 'PublishedFile')) == 0
+        assert 'In Progress' in found[0].get_notifications()[0].get_message()
+        assert second_session.stats()['cache'] == {'hits': 1, 'misses': 0, 'hit_rate': 1.0}
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_cache_eviction():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = HydrationCache(os.path.join(directory, 'hydration_cache.db'), max_entries=2)
+        for entity_id in range(1, 4):
+            cache.set('Note', entity_id, {'id': entity_id, 'subject': 'note'})
+        # Only the most recent entries are kept
+        assert cache.get('Note', 3) == {'id': 3, 'subject': 'note'}
+        assert cache.get('Note', 1) is None
+        # Entries missing a requested field are misses
+        assert cache.get('Note', 3, ['id', 'content']) is None
+        # Expired entries are misses
+        cache.ttl = -1
+        assert cache.get('Note', 3) is None
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 3
+        # The eviction queries use the stored_at index instead of sorting the table
+        connection = sqlite3.connect(cache.path)
+        plan = connection.execute('EXPLAIN QUERY PLAN SELECT rowid FROM entities ORDER BY stored_at DESC').fetchall()
+        connection.close()
+        assert 'entities_stored_at' in str(plan)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_cache_cannot_be_created():
+    directory = tempfile.mkdtemp()
+    try:
+        # A file where the cache directory should be
+        path = os.path.join(directory, 'cache')
+        open(path, 'w').close()
+        cache = HydrationCache(os.path.join(path, 'hydration_cache.db'))
+        cache.set('Note', 1, {'id': 1})
+        assert cache.get('Note', 1) is None
+        assert cache.stats()['misses'] == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test_sessions_share_cache()
+    test_cache_eviction()
+    test_cache_cannot_be_created()
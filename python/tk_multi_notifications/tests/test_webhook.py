@@ -0,0 +1,148 @@
+import os
+import sys
+import hmac
+import json
+import hashlib
+import urllib2
+
+# add path to be able to import the modules we need for the tests
+paths = [
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+    os.path.abspath(os.path.dirname(__file__)),
+]
+for path in paths:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from webhook import WebhookReceiver
+from events_filter import PRIORITY_URGENT
+from events_filter import PRIORITY_BULK
+from test_events_filters_offline import setup_shotgun
+from test_events_filters_offline import create_events_filter
+from test_events_filters_offline import add_status_change
+from test_events_filters_offline import add_publish
+
+
+def post_events(url, events, secret=None):
+    """ Stand-in for Shotgun, POST the events as a batched webhook payload and return the response code """
+    deliveries = []
+    for event in events:
+        deliveries.append({
+            'event_log_entry_id': event['id'],
+            'event_type': event['event_type'],
+            'operation': 'create',
+            'entity': {'type': event['entity']['type'], 'id': event['entity']['id']},
+            'meta': dict(event['meta'], attribute_name=event['attribute_name']),
+        })
+    body = json.dumps({'data': {'deliveries': deliveries}, 'timestamp': '2026-10-19T00:00:00Z'})
+    request = urllib2.Request(url, body, {'Content-Type': 'application/json'})
+    if secret:
+        request.add_header('X-SG-Signature', 'sha1=' + hmac.new(secret, body, hashlib.sha1).hexdigest())
+    try:
+        return urllib2.urlopen(request).getcode()
+    except urllib2.HTTPError as error:
+        return error.code
+
+
+def test_webhook_push():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    event_filter.enable_push(reconcile_interval=300)
+    lanes = []
+    receiver = WebhookReceiver(event_filter, secret='secret', callback=lanes.append)
+    receiver.start()
+    try:
+        # First run reconciles with the event log, then only the pushed events are processed
+        assert event_filter.run() == []
+        status_event = add_status_change(sg, task, 'ip')
+        other_event = add_status_change(sg, other_task, 'fin')
+        assert post_events(receiver.url(), [status_event, other_event], 'secret') == 200
+        assert post_events(receiver.url(), [status_event], 'wrong') == 401
+        assert lanes == [PRIORITY_URGENT]
+        del sg.calls[:]
+        found = event_filter.run(PRIORITY_URGENT)
+        assert len(found) == 1
+        assert len(found[0].get_notifications()) == 1
+        assert not any(call[1] == 'EventLogEntry' for call in sg.calls)
+
+        # A webhook that never arrived is filled in by the reconciliation poll,
+        # without counting the pushed events a second time
+        lost_event = add_publish(sg, task['entity'], 'comp_v001')
+        pushed_event = add_publish(sg, task['entity'], 'comp_v002')
+        assert post_events(receiver.url(), [pushed_event], 'secret') == 200
+        found = event_filter.run(PRIORITY_BULK)
+        assert [n.get_message().split('"')[1] for n in found[0].get_notifications()] == ['comp_v002']
+        event_filter.reconcile()
+        found = event_filter.run()
+        assert len(found) == 1
+        assert [n.get_message().split('"')[1] for n in found[0].get_notifications()] == ['comp_v001']
+        assert event_filter.run() == []
+    finally:
+        receiver.stop()
+
+
+def test_port_already_used():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    first_receiver = WebhookReceiver(event_filter)
+    assert first_receiver.start()
+    try:
+        # A second session configured with the same port does not raise
+        second_receiver = WebhookReceiver(event_filter, port=first_receiver.port)
+        assert not second_receiver.start()
+        assert not second_receiver.is_running()
+    finally:
+        first_receiver.stop()
+
+
+def test_network_host_requires_secret():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    # Anyone reaching the port could push fake events without a secret
+    receiver = WebhookReceiver(event_filter, host='0.0.0.0')
+    assert not receiver.start()
+    assert not receiver.is_running()
+    receiver = WebhookReceiver(event_filter, host='0.0.0.0', secret='secret')
+    assert receiver.start()
+    receiver.stop()
+
+
+def test_reconcile_backlog_does_not_count_pushed_events():
+    sg, task, other_task = setup_shotgun()
+    event_filter = create_events_filter(sg, task)
+    for _filter in event_filter.filters():
+        _filter.backlog_threshold = 20
+    event_filter.enable_push()
+    assert event_filter.run() == []
+    pushed = [add_status_change(sg, task, 'ip') for i in range(3)]
+    pushed += [add_publish(sg, task['entity'], 'comp_v%03d' % i) for i in range(3)]
+    event_filter.push(pushed)
+    assert sum(f.count() for f in event_filter.run()) == 6
+
+    # Enough site traffic for the reconciliation poll to summarize the backlog
+    for i in range(30):
+        sg.add_event('Shotgun_Shot_Change', task['entity'], attribute_name='description')
+    event_filter.reconcile()
+    found = event_filter.run()
+    assert ('summarize', 'EventLogEntry') in sg.calls
+    assert found == []
+    assert not any(f.more() for f in event_filter.filters())
+
+    # Pushed status changes of other tasks are not in the summary of the task status changes
+    event_filter.push([add_status_change(sg, other_task, 'fin') for i in range(10)])
+    assert event_filter.run() == []
+    status_event = add_status_change(sg, task, 'fin')
+    for i in range(30):
+        sg.add_event('Shotgun_Shot_Change', task['entity'], attribute_name='description')
+    event_filter.reconcile()
+    found = event_filter.run(PRIORITY_URGENT)
+    assert len(found) == 1
+    assert found[0].backlog == {'count': 1, 'fetched': 1}
+    assert [n.get_message() for n in found[0].get_notifications()] == ['Status of task sh010 comp changed to Final']
+
+
+if __name__ == '__main__':
+    test_webhook_push()
+    test_port_already_used()
+    test_network_host_requires_secret()
+    test_reconcile_backlog_does_not_count_pushed_events()
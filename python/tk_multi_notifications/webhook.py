@@ -0,0 +1,139 @@
+"""
+This module contains a small local HTTP server receiving the
+Shotgun webhooks payloads and pushing their events to the
+events filter, so new events do not have to be polled
+"""
+import time
+import hmac
+import json
+import socket
+import hashlib
+import threading
+import BaseHTTPServer
+
+
+def log(msg):
+    print time.strftime("%Y/%m/%d %H:%M:%S", time.localtime()) +": "+msg
+
+
+def event_from_delivery(data):
+    """ Convert the data of a webhook delivery to an event like the ones found in the EventLogEntry table """
+    meta = data.get('meta') or {}
+    return {
+        'id': int(data['event_log_entry_id']),
+        'event_type': data['event_type'],
+        'attribute_name': data.get('attribute_name') or meta.get('attribute_name'),
+        'meta': meta,
+        'entity': data.get('entity'),
+    }
+
+
+def events_from_payload(payload):
+    """ Return the events of a webhook payload, batched deliveries hold several events """
+    data = payload['data']
+    deliveries = data.get('deliveries', [data])
+    return [event_from_delivery(delivery) for delivery in deliveries]
+
+
+def is_loopback(host):
+    """ Return True if the host only accepts connections from the local machine """
+    return host == 'localhost' or host == '::1' or host.startswith('127.')
+
+
+class WebhookRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Handle the webhooks POST requests """
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not receiver.valid_signature(body, self.headers.get('X-SG-Signature', '')):
+            self.send_response(401)
+            self.end_headers()
+            return
+        try:
+            events = events_from_payload(json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            self.send_response(400)
+            self.end_headers()
+            return
+        receiver.receive(events)
+        # Answer right away, Shotgun considers slow deliveries as failures
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        """ Do not log every request on stderr """
+        pass
+
+
+class WebhookReceiver(object):
+    """
+    Local HTTP endpoint receiving the webhooks of the watched event types.
+    The events are pushed to the events filter and the callback is called
+    with the priority of every lane that got new events
+    """
+    def __init__(self, event_filter, host='127.0.0.1', port=0, secret=None, callback=None):
+        super(WebhookReceiver, self).__init__()
+        self.event_filter = event_filter
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.callback = callback
+        self._server = None
+        self._thread = None
+
+    def is_running(self):
+        return self._server is not None
+
+    def start(self):
+        """
+        Start serving in a background thread. Return False if the endpoint
+        cannot listen, when the port is used by another session for example.
+        The pushed events are trusted as is, the endpoint refuses to listen on
+        other machines connections without a secret to check their signature
+        """
+        if self.is_running():
+            return True
+        if not self.secret and not is_loopback(self.host):
+            log('Webhook receiver cannot listen on %s without a secret, anyone reaching the port could push events' % self.host)
+            return False
+        try:
+            self._server = BaseHTTPServer.HTTPServer((self.host, self.port), WebhookRequestHandler)
+        except socket.error as error:
+            log('Webhook receiver cannot listen on %s:%d: %s' % (self.host, self.port, error))
+            return False
+        self._server.receiver = self
+        # Store the port actually used, port 0 lets the system pick one
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        log('Webhook receiver listening on %s:%d' % (self.host, self.port))
+        return True
+
+    def stop(self):
+        """ Stop serving and close the socket """
+        if not self.is_running():
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def url(self):
+        return 'http://%s:%d/' % (self.host, self.port)
+
+    def valid_signature(self, body, signature):
+        """ Check the HMAC signature Shotgun adds to the payload when the webhook has a secret token """
+        if not self.secret:
+            return True
+        expected = 'sha1=' + hmac.new(str(self.secret), body, hashlib.sha1).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    def receive(self, events):
+        """ Push the events to the events filter and notify the lanes that got new events """
+        priorities = self.event_filter.push(events)
+        if self.callback is not None:
+            for priority in priorities:
+                self.callback(priority)